@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Конфигурация gunicorn для деплоя (Render, Railway, Heroku и т.д.)
+Запуск: gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8443')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "3"))
+# Потоки внутри воркера перекрывают ожидание сети / SQLite
+worker_class = "gthread"
+threads = 4
+# Приложение импортируется один раз в мастере и достаётся воркерам через fork.
+# Токены каждый воркер перечитывает из SQLite в post_fork, соединение с базой
+# открывает своё (см. TokenManager._db)
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Каждый воркер перечитывает токены из SQLite: снимок мастера устаревает после /sync_tokens."""
+    from app import token_manager
+    token_manager.reload()
@@ -4,72 +4,97 @@
 Эндпоинты: activate, heartbeat, hook_config.
 Токены управляются через TokenManager (поддержка времени жизни и статуса).
 """
+import logging
 import os
 import ssl
-import json
-from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, request, jsonify
+import orjson
+from flask import Flask, request
 from flask_cors import CORS
 
 from token_manager import TokenManager
 
 APP_DIR = Path(__file__).resolve().parent
 
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("license")
+# DEBUG-логи выключены по умолчанию, включаются через LOG_LEVEL=DEBUG
+_log_level = logging.getLevelName(os.getenv("LOG_LEVEL", "WARNING").upper())
+# Неизвестное значение LOG_LEVEL не должно мешать запуску
+log.setLevel(_log_level if isinstance(_log_level, int) else logging.WARNING)
+
+
 app = Flask(__name__)
 CORS(app)  # Разрешаем CORS для работы с приложением
 token_manager = TokenManager()
 
 
+def ojsonify(obj, status=200):
+    """Аналог flask.jsonify, но сериализует через orjson."""
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+# Постоянный ответ {"ok": true} для heartbeat/hook_config: сериализуем один раз
+_OK_BYTES = orjson.dumps({"ok": True})
+_OK_ETAG = '"ok-v1"'
+
+
+def ok_response():
+    """Ответ {"ok": true} с ETag; на совпадающий If-None-Match отдаёт 304 без тела."""
+    headers = {"ETag": _OK_ETAG, "Cache-Control": "private, max-age=60"}
+    if request.headers.get("If-None-Match") == _OK_ETAG:
+        return app.response_class(status=304, headers=headers)
+    return app.response_class(_OK_BYTES, mimetype="application/json", headers=headers)
+
+
+# Готовый ответ для токенов из негативного кэша TokenManager
+_NOT_FOUND_BYTES = orjson.dumps({"detail": "Токен не найден", "ok": False})
+
+
+def load_json_body():
+    """Декодирует JSON тело запроса через orjson. При ошибке возвращает None."""
+    try:
+        return orjson.loads(request.get_data() or b"{}")
+    except orjson.JSONDecodeError:
+        return None
+
+
 def get_token_from_request():
-    """Токен может быть в JSON body или в form."""
-    # Логируем запрос для отладки
-    print(f"DEBUG: Request method: {request.method}")
-    print(f"DEBUG: Request content-type: {request.content_type}")
-    print(f"DEBUG: Request data: {request.get_data(as_text=True)[:200]}")
-    
+    """Токен может быть в JSON body, в form или в query string."""
     if request.is_json:
-        data = request.get_json(silent=True) or {}
-        print(f"DEBUG: JSON data: {data}")
+        # Обычный случай: клиент шлёт токен в JSON. Пустое тело (GET) не декодируем
+        if not request.get_data():
+            return None
+        data = load_json_body()
+        if not isinstance(data, dict):
+            return None
         token = data.get("token") or data.get("Token")
-        print(f"DEBUG: Extracted token: {token}")
-        return token
-    
-    # Также пробуем form data
-    form_token = request.form.get("token") or request.form.get("Token")
-    if form_token:
-        print(f"DEBUG: Form token: {form_token}")
-        return form_token
+        return token if isinstance(token, str) else None
     
-    # Пробуем получить из query string
-    query_token = request.args.get("token") or request.args.get("Token")
-    if query_token:
-        print(f"DEBUG: Query token: {query_token}")
-        return query_token
-    
-    return None
+    # request.values объединяет form и query string
+    return request.values.get("token") or request.values.get("Token")
 
 
 def check_token():
     """Проверяет токен через TokenManager."""
     token = get_token_from_request()
-    print(f"DEBUG: check_token called, token: {token}")
+    log.debug("check_token called, token: %s", token)
     
     if not token:
-        print("DEBUG: No token found in request")
-        return None, jsonify({"detail": "Missing token", "ok": False}), 400
+        log.debug("No token found in request")
+        return None, ojsonify({"detail": "Missing token", "ok": False}, 400)
+    
+    if token_manager.is_known_bad(token):
+        return None, app.response_class(_NOT_FOUND_BYTES, status=403, mimetype="application/json")
     
-    # Показываем доступные токены для отладки
-    all_tokens = list(token_manager.tokens.keys())
-    print(f"DEBUG: Available tokens: {all_tokens[:5]}... (total: {len(all_tokens)})")
-    print(f"DEBUG: Checking token: {token[:20]}...")
+    log.debug("Checking token: %.20s... (total tokens: %d)", token, len(token_manager.tokens))
     
     is_valid, error = token_manager.is_valid(token)
-    print(f"DEBUG: Token validation result: valid={is_valid}, error={error}")
+    log.debug("Token validation result: valid=%s, error=%s", is_valid, error)
     
     if not is_valid:
-        return None, jsonify({"detail": error or "Invalid token", "ok": False}), 403
+        return None, ojsonify({"detail": error or "Invalid token", "ok": False}, 403)
     
     return token, None
 
@@ -79,15 +104,15 @@ def check_token():
 @app.route("/activate", methods=["POST", "GET"])
 @app.route("/api/activate", methods=["POST", "GET"])
 def activate():
-    print(f"DEBUG: /activate called, method: {request.method}")
+    log.debug("/activate called, method: %s", request.method)
     token, err = check_token()
     if err:
-        print(f"DEBUG: Token check failed: {err.get_json() if hasattr(err, 'get_json') else err}")
+        log.debug("Token check failed: %s", err.status)
         return err
     
-    print(f"DEBUG: Token validated successfully: {token}")
+    log.debug("Token validated successfully: %s", token)
     # Успешная активация
-    return jsonify({"ok": True, "success": True, "token": token})
+    return ojsonify({"ok": True, "success": True, "token": token})
 
 
 @app.route("/heartbeat", methods=["POST", "GET"])
@@ -96,7 +121,7 @@ def heartbeat():
     token, err = check_token()
     if err:
         return err
-    return jsonify({"ok": True})
+    return ok_response()
 
 
 @app.route("/hook_config", methods=["POST", "GET"])
@@ -106,24 +131,32 @@ def hook_config():
     if err:
         return err
     # HookConfigResp(ok=...) — приложение ждёт ok
-    return jsonify({"ok": True})
+    return ok_response()
+
+
+# Тело ответа "/" зависит только от набора токенов: (token_manager.version, bytes)
+_root_body = (-1, b"")
 
 
 @app.route("/", methods=["GET"])
 def root():
-    tokens = token_manager.list_tokens()
-    active_tokens = [t for t in tokens if t.get("active", True)]
-    # Показываем первые несколько токенов для отладки (первые 10 символов)
-    token_previews = [t["token"][:10] + "..." for t in tokens[:5]]
-    return jsonify({
-        "service": "license",
-        "endpoints": ["/activate", "/heartbeat", "/hook_config", "/sync_tokens"],
-        "tokens_file": str(token_manager.tokens_file),
-        "total_tokens": len(tokens),
-        "active_tokens": len(active_tokens),
-        "token_previews": token_previews,  # Для отладки
-        "has_env_tokens": bool(os.getenv("TOKENS_JSON")),
-    })
+    global _root_body
+    version = token_manager.version
+    if _root_body[0] != version:
+        tokens = token_manager.list_tokens()
+        active_tokens = [t for t in tokens if t.get("active", True)]
+        # Показываем первые несколько токенов для отладки (первые 10 символов)
+        token_previews = [t["token"][:10] + "..." for t in tokens[:5]]
+        _root_body = (version, orjson.dumps({
+            "service": "license",
+            "endpoints": ["/activate", "/heartbeat", "/hook_config", "/sync_tokens"],
+            "tokens_file": str(token_manager.db_file),
+            "total_tokens": len(tokens),
+            "active_tokens": len(active_tokens),
+            "token_previews": token_previews,  # Для отладки
+            "has_env_tokens": bool(os.getenv("TOKENS_JSON")),
+        }))
+    return app.response_class(_root_body[1], mimetype="application/json")
 
 
 @app.route("/test", methods=["GET", "POST"])
@@ -131,7 +164,7 @@ def test():
     """Тестовый эндпоинт для проверки работы сервера"""
     token = get_token_from_request()
     tokens = token_manager.list_tokens()
-    return jsonify({
+    return ojsonify({
         "status": "ok",
         "received_token": token[:20] + "..." if token else None,
         "total_tokens": len(tokens),
@@ -144,53 +177,16 @@ def test():
 def sync_tokens():
     """Синхронизация токенов от бота на сервер"""
     try:
-        data = request.get_json()
-        if not data or "tokens" not in data:
-            return jsonify({"ok": False, "error": "Invalid request"}), 400
+        data = load_json_body()
+        if not isinstance(data, dict) or "tokens" not in data:
+            return ojsonify({"ok": False, "error": "Invalid request"}, 400)
         
         tokens_data = data["tokens"]
+        token_manager.sync_tokens(tokens_data)
         
-        # Обновляем токены на сервере
-        for token_info in tokens_data:
-            token = token_info.get("token")
-            if not token:
-                continue
-            
-            try:
-                # Проверяем, существует ли токен
-                if token not in token_manager.tokens:
-                    # Создаём новый токен
-                    expires_at = None
-                    if token_info.get("expires_at"):
-                        expires_at = datetime.fromisoformat(token_info["expires_at"])
-                    
-                    created_at = datetime.now()
-                    if token_info.get("created_at"):
-                        created_at = datetime.fromisoformat(token_info["created_at"])
-                    
-                    token_manager.tokens[token] = {
-                        "created_at": created_at,
-                        "expires_at": expires_at,
-                        "active": token_info.get("active", True),
-                        "description": token_info.get("description", ""),
-                        "used_count": token_info.get("used_count", 0),
-                        "last_used": None
-                    }
-                else:
-                    # Обновляем существующий токен
-                    if "active" in token_info:
-                        token_manager.tokens[token]["active"] = token_info["active"]
-                    if "description" in token_info:
-                        token_manager.tokens[token]["description"] = token_info["description"]
-            except Exception as e:
-                print(f"Ошибка при синхронизации токена {token}: {e}")
-                continue
-        
-        token_manager._save_tokens()
-        
-        return jsonify({"ok": True, "synced": len(tokens_data)})
+        return ojsonify({"ok": True, "synced": len(tokens_data)})
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+        return ojsonify({"ok": False, "error": str(e)}, 500)
 
 
 # --- Запуск с HTTPS ---
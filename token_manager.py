@@ -1,102 +1,377 @@
 # -*- coding: utf-8 -*-
 """
 Менеджер токенов с поддержкой времени жизни и статуса.
-Токены хранятся в JSON формате: tokens.json
+Токены хранятся в SQLite (tokens.db, режим WAL), по строке на токен.
+tokens.json / TOKENS_JSON используются только для начального заполнения пустой базы.
 """
+import atexit
 import json
+import logging
+import math
 import os
 import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Set, Tuple
 
 APP_DIR = Path(__file__).resolve().parent
 # На Render.com файлы могут не сохраняться, используем переменную окружения
 # или /tmp (но лучше использовать переменные окружения для токенов)
 TOKENS_FILE = Path(os.getenv("TOKENS_FILE", str(APP_DIR / "tokens.json")))
+TOKENS_DB = Path(os.getenv("TOKENS_DB", str(APP_DIR / "tokens.db")))
+# Статистика использования (used_count/last_used) пишется на диск не на каждый
+# запрос, а пачками: раз в TOKENS_FLUSH_INTERVAL секунд или каждые FLUSH_EVERY проверок
+FLUSH_INTERVAL = float(os.getenv("TOKENS_FLUSH_INTERVAL", "30"))
+FLUSH_EVERY = 100
+# Длина префикса токена для вторичного индекса (поиск по префиксу без обхода всех токенов)
+PREFIX_LEN = 8
+# Сколько секунд list_tokens() отдаёт закэшированный полный список
+LIST_CACHE_TTL = 5.0
+# Сколько последних неизвестных токенов помнить (отсекает перебор токенов без поиска)
+BAD_TOKENS_MAX = 4096
+
+log = logging.getLogger("license.tokens")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    created_at REAL,
+    expires_at REAL,
+    active INTEGER,
+    description TEXT,
+    used_count INTEGER,
+    last_used REAL
+)
+"""
+_COLUMNS = "token, created_at, expires_at, active, description, used_count, last_used"
+
+
+def expires_timestamp(expires_at: Optional[datetime]) -> float:
+    """Переводит expires_at в POSIX timestamp для быстрой проверки срока (inf = бессрочный)."""
+    if expires_at is None:
+        return math.inf
+    if expires_at == datetime.min:
+        return -math.inf
+    return expires_at.timestamp()
+
+
+def _to_db_time(value) -> Optional[float]:
+    """datetime -> REAL для SQLite (None и нераспознанные значения -> NULL)."""
+    if not isinstance(value, datetime):
+        return None
+    if value == datetime.min:
+        return -math.inf
+    return value.timestamp()
+
+
+def _from_db_time(value: Optional[float]) -> Optional[datetime]:
+    """REAL из SQLite -> datetime."""
+    if value is None:
+        return None
+    if value == -math.inf:
+        return datetime.min
+    return datetime.fromtimestamp(value)
+
+
+def _to_row(token: str, info: Dict) -> tuple:
+    """Запись токена -> строка таблицы tokens."""
+    return (
+        token,
+        _to_db_time(info.get("created_at")),
+        _to_db_time(info.get("expires_at")),
+        int(bool(info.get("active", True))),
+        info.get("description", ""),
+        info.get("used_count", 0),
+        _to_db_time(info.get("last_used")),
+    )
+
+
+def _from_row(row: tuple) -> Dict:
+    """Строка таблицы tokens -> запись токена."""
+    _, created_at, expires_at, active, description, used_count, last_used = row
+    expires_at = _from_db_time(expires_at)
+    return {
+        "created_at": _from_db_time(created_at),
+        "expires_at": expires_at,
+        "expires_at_ts": expires_timestamp(expires_at),
+        "active": bool(active),
+        "description": description or "",
+        "used_count": used_count or 0,
+        "last_used": _from_db_time(last_used)
+    }
+
+
+@lru_cache(maxsize=8192)
+def _parse_iso(value: str) -> datetime:
+    """datetime.fromisoformat с кэшем: в TOKENS_JSON и при массовой синхронизации даты часто повторяются."""
+    return datetime.fromisoformat(value)
+
+
+# Поля синхронизации и допустимые типы (bool - подкласс int, поэтому used_count проверяем отдельно)
+_SYNC_FIELD_TYPES = {"active": bool, "description": str, "used_count": int}
+
+
+def _sync_entry_valid(token_info: Dict) -> bool:
+    """Проверяет запись синхронизации: строковый токен и корректные типы полей."""
+    token = token_info.get("token") if isinstance(token_info, dict) else None
+    if not isinstance(token, str) or not token:
+        return False
+    for field, field_type in _SYNC_FIELD_TYPES.items():
+        value = token_info.get(field)
+        if field in token_info and (not isinstance(value, field_type)
+                                    or field == "used_count" and isinstance(value, bool)):
+            log.warning("Ошибка при синхронизации токена %s: некорректное поле %s=%r", token, field, value)
+            return False
+    return True
+
+
+def _sync_token_info(token_info: Dict) -> Optional[Dict]:
+    """Строит запись нового токена из данных синхронизации (None, если даты некорректны)."""
+    try:
+        expires_at = _parse_iso(token_info["expires_at"]) if token_info.get("expires_at") else None
+        created_at = _parse_iso(token_info["created_at"]) if token_info.get("created_at") else datetime.now()
+    except (TypeError, ValueError) as e:
+        log.warning("Ошибка при синхронизации токена %s: %s", token_info["token"], e)
+        return None
+    return {
+        "created_at": created_at,
+        "expires_at": expires_at,
+        "expires_at_ts": expires_timestamp(expires_at),
+        "active": token_info.get("active", True),
+        "description": token_info.get("description", ""),
+        "used_count": token_info.get("used_count", 0),
+        "last_used": None
+    }
 
 
 class TokenManager:
     def __init__(self):
         self.tokens_file = TOKENS_FILE
-        self.tokens = self._load_tokens()
+        self.db_file = TOKENS_DB
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = 0
+        self.tokens: Dict[str, Dict] = {}
+        self._prefix_index: Dict[str, Set[str]] = defaultdict(set)
+        # Несохранённые проверки: token -> сколько раз использован с последнего flush
+        self._usage: Dict[str, int] = {}
+        self._pending_uses = 0
+        self._flush_timer: Optional[threading.Timer] = None
+        self._list_cache: Optional[List[Dict]] = None
+        self._list_cache_ts = 0.0
+        # Увеличивается при каждом изменении набора токенов (для кэшей вне TokenManager)
+        self.version = 0
+        # Недавно отклонённые неизвестные токены (LRU)
+        self._bad_tokens: "OrderedDict[str, None]" = OrderedDict()
+        self.reload()
+        atexit.register(self.flush)
+
+    def reload(self):
+        """
+        Перечитывает токены из базы.
+        
+        Вызывается в каждом воркере gunicorn после fork (см. gunicorn.conf.py):
+        иначе воркер, перезапущенный мастером, видел бы только токены на момент старта.
+        """
+        with self._lock:
+            self.tokens = self._load_db()
+            self._prefix_index = defaultdict(set)
+            for token in self.tokens:
+                self._index_token(token)
+            self._bad_tokens.clear()
+            self._changed()
+
+    def _db(self) -> sqlite3.Connection:
+        """Соединение с SQLite (своё для каждого процесса, т.к. gunicorn форкает воркеры)."""
+        if self._conn is None or self._conn_pid != os.getpid():
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _execute(self, statements: List[Tuple[str, List[tuple]]]):
+        """Выполняет пары (запрос, строки) одной транзакцией; ошибки пробрасываются."""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                for sql, rows in statements:
+                    if rows:
+                        conn.executemany(sql, rows)
+
+    def _write(self, sql: str, rows: List[tuple]):
+        """Выполняет запрос для каждой строки rows одной транзакцией."""
+        if not rows:
+            return
+        try:
+            self._execute([(sql, rows)])
+        except (sqlite3.Error, OSError) as e:
+            # На Render.com диск может быть недоступен - токены остаются в памяти
+            log.warning("Could not save tokens to database: %s", e)
+
+    def _close_db(self):
+        """Закрывает соединение с SQLite (следующий запрос откроет новое)."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _load_db(self) -> Dict[str, Dict]:
+        """Загружает токены из SQLite; пустую базу заполняет из tokens.json / TOKENS_JSON."""
+        try:
+            return self._read_db()
+        finally:
+            # С preload_app загрузка идёт в мастере gunicorn: соединение не должно
+            # переживать fork, воркеры откроют свои
+            self._close_db()
+
+    def _read_db(self) -> Dict[str, Dict]:
+        """Читает все токены из SQLite (см. _load_db)."""
+        try:
+            with self._lock:
+                rows = self._db().execute(f"SELECT {_COLUMNS} FROM tokens").fetchall()
+        except (sqlite3.Error, OSError) as e:
+            log.warning("Could not open tokens database %s: %s", self.db_file, e)
+            return self._load_tokens()
+        
+        if rows:
+            log.debug("Loaded %d tokens from database", len(rows))
+            return {row[0]: _from_row(row) for row in rows}
+        
+        data = self._load_tokens()
+        self._write(
+            f"INSERT OR IGNORE INTO tokens ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [_to_row(token, info) for token, info in data.items()]
+        )
+        return data
 
     def _load_tokens(self) -> Dict[str, Dict]:
         """Загружает токены из файла или переменной окружения."""
         # Сначала пробуем загрузить из переменной окружения (для Render.com)
         env_tokens = os.getenv("TOKENS_JSON")
-        print(f"DEBUG: TOKENS_JSON env var exists: {bool(env_tokens)}")
+        log.debug("TOKENS_JSON env var exists: %s", bool(env_tokens))
         if env_tokens:
             try:
                 data = json.loads(env_tokens)
-                print(f"DEBUG: Loaded {len(data)} tokens from TOKENS_JSON")
-                # Конвертируем строки дат обратно в datetime для проверки
-                for token, info in data.items():
-                    if "created_at" in info and isinstance(info["created_at"], str):
-                        try:
-                            info["created_at"] = datetime.fromisoformat(info["created_at"])
-                        except:
-                            pass
-                    if "expires_at" in info and info["expires_at"] and isinstance(info["expires_at"], str):
-                        try:
-                            info["expires_at"] = datetime.fromisoformat(info["expires_at"])
-                        except:
-                            pass
+                log.debug("Loaded %d tokens from TOKENS_JSON", len(data))
+                self._normalize_dates(data)
                 return data
             except (json.JSONDecodeError, ValueError) as e:
-                print(f"DEBUG: Error parsing TOKENS_JSON: {e}")
+                log.debug("Error parsing TOKENS_JSON: %s", e)
                 pass
         
         # Если нет в переменной окружения, загружаем из файла
         if not self.tokens_file.exists():
-            print(f"DEBUG: tokens.json file does not exist: {self.tokens_file}")
+            log.debug("tokens.json file does not exist: %s", self.tokens_file)
             return {}
         try:
             with open(self.tokens_file, "r", encoding="utf-8") as f:
                 data = json.load(f)
-                print(f"DEBUG: Loaded {len(data)} tokens from file")
-                # Конвертируем строки дат обратно в datetime для проверки
-                for token, info in data.items():
-                    if "created_at" in info and isinstance(info["created_at"], str):
-                        try:
-                            info["created_at"] = datetime.fromisoformat(info["created_at"])
-                        except:
-                            pass
-                    if "expires_at" in info and info["expires_at"] and isinstance(info["expires_at"], str):
-                        try:
-                            info["expires_at"] = datetime.fromisoformat(info["expires_at"])
-                        except:
-                            pass
+                log.debug("Loaded %d tokens from file", len(data))
+                self._normalize_dates(data)
                 return data
         except (json.JSONDecodeError, ValueError) as e:
-            print(f"DEBUG: Error loading tokens from file: {e}")
+            log.debug("Error loading tokens from file: %s", e)
             return {}
 
-    def _save_tokens(self):
-        """Сохраняет токены в файл и обновляет переменную окружения (если нужно)."""
-        # Конвертируем datetime в строки для JSON
-        data = {}
-        for token, info in self.tokens.items():
-            data[token] = info.copy()
-            if isinstance(data[token].get("created_at"), datetime):
-                data[token]["created_at"] = data[token]["created_at"].isoformat()
-            if isinstance(data[token].get("expires_at"), datetime):
-                if data[token]["expires_at"]:
-                    data[token]["expires_at"] = data[token]["expires_at"].isoformat()
-        
-        # Сохраняем в файл (если возможно)
-        try:
-            # Создаём директорию если нужно
-            self.tokens_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.tokens_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            # На Render.com файлы могут не сохраняться - это нормально
-            print(f"Warning: Could not save tokens to file: {e}")
-        
-        # Также обновляем переменную окружения (для Render.com)
-        # Но это не будет работать автоматически - нужно обновлять вручную в Render
-        # Или использовать внешнее хранилище
+    @staticmethod
+    def _normalize_dates(data: Dict[str, Dict]):
+        """Конвертирует строки дат в datetime, чтобы не разбирать их на каждой проверке."""
+        for token, info in data.items():
+            if isinstance(info.get("created_at"), str):
+                try:
+                    info["created_at"] = _parse_iso(info["created_at"])
+                except ValueError:
+                    pass
+            expires_at = info.get("expires_at")
+            if not expires_at:
+                info["expires_at"] = None
+            elif isinstance(expires_at, str):
+                try:
+                    info["expires_at"] = _parse_iso(expires_at)
+                except ValueError:
+                    # Нечитаемый срок действия считаем истёкшим, а не бессрочным
+                    log.warning("Invalid expires_at for token %.8s...: %r", token, expires_at)
+                    info["expires_at"] = datetime.min
+            info["expires_at_ts"] = expires_timestamp(info["expires_at"])
+            if isinstance(info.get("last_used"), str):
+                try:
+                    info["last_used"] = _parse_iso(info["last_used"])
+                except ValueError:
+                    info["last_used"] = None
+
+    def _index_token(self, token: str):
+        """Добавляет токен в индекс по префиксу."""
+        self._prefix_index[token[:PREFIX_LEN]].add(token)
+
+    def _unindex_token(self, token: str):
+        """Удаляет токен из индекса по префиксу."""
+        prefix = token[:PREFIX_LEN]
+        bucket = self._prefix_index.get(prefix)
+        if bucket is not None:
+            bucket.discard(token)
+            if not bucket:
+                del self._prefix_index[prefix]
+
+    def find_tokens(self, prefix: str) -> List[str]:
+        """Ищет токены по префиксу (для админских запросов)."""
+        with self._lock:
+            if len(prefix) >= PREFIX_LEN:
+                candidates = self._prefix_index.get(prefix[:PREFIX_LEN], ())
+            else:
+                candidates = self.tokens
+            return sorted(t for t in candidates if t.startswith(prefix))
+
+    def is_known_bad(self, token: str) -> bool:
+        """Был ли токен недавно отклонён как неизвестный (негативный кэш)."""
+        with self._lock:
+            if token not in self._bad_tokens:
+                return False
+            self._bad_tokens.move_to_end(token)
+            return True
+
+    def _changed(self):
+        """Сбрасывает кэши после изменения токенов (создание, статус, удаление, синхронизация)."""
+        self._list_cache = None
+        self.version += 1
+
+    def _mark_used(self, token: str):
+        """Запоминает использование токена и планирует сохранение статистики."""
+        with self._lock:
+            self._usage[token] = self._usage.get(token, 0) + 1
+            self._pending_uses += 1
+            if self._pending_uses >= FLUSH_EVERY:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(FLUSH_INTERVAL, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        """Сохраняет накопленную статистику использования в базу."""
+        with self._lock:
+            timer, self._flush_timer = self._flush_timer, None
+            if timer is not None:
+                timer.cancel()
+            usage, self._usage = self._usage, {}
+            self._pending_uses = 0
+            # Инкременты, а не абсолютные значения: у каждого воркера свой счётчик в памяти
+            rows = [
+                (count, _to_db_time(self.tokens[token]["last_used"]), token)
+                for token, count in usage.items() if token in self.tokens
+            ]
+            self._write(
+                "UPDATE tokens SET used_count = COALESCE(used_count, 0) + ?, "
+                "last_used = MAX(COALESCE(last_used, 0), ?) WHERE token = ?",
+                rows
+            )
 
     def create_token(
         self,
@@ -117,32 +392,40 @@ class TokenManager:
         Returns:
             Созданный токен
         """
-        if custom_token:
-            token = custom_token.strip()
-        else:
-            token = secrets.token_hex(16)
-        
-        if token in self.tokens:
-            raise ValueError(f"Токен уже существует: {token}")
-        
-        now = datetime.now()
-        expires_at = None
-        
-        if days_valid:
-            expires_at = now + timedelta(days=days_valid)
-        elif hours_valid:
-            expires_at = now + timedelta(hours=hours_valid)
-        
-        self.tokens[token] = {
-            "created_at": now,
-            "expires_at": expires_at,
-            "active": True,
-            "description": description,
-            "used_count": 0,
-            "last_used": None
-        }
-        self._save_tokens()
-        return token
+        with self._lock:
+            if custom_token:
+                token = custom_token.strip()
+            else:
+                token = secrets.token_hex(16)
+            
+            if token in self.tokens:
+                raise ValueError(f"Токен уже существует: {token}")
+            
+            now = datetime.now()
+            expires_at = None
+            
+            if days_valid:
+                expires_at = now + timedelta(days=days_valid)
+            elif hours_valid:
+                expires_at = now + timedelta(hours=hours_valid)
+            
+            self.tokens[token] = {
+                "created_at": now,
+                "expires_at": expires_at,
+                "expires_at_ts": expires_timestamp(expires_at),
+                "active": True,
+                "description": description,
+                "used_count": 0,
+                "last_used": None
+            }
+            self._index_token(token)
+            self._bad_tokens.pop(token, None)
+            self._changed()
+            self._write(
+                f"INSERT INTO tokens ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [_to_row(token, self.tokens[token])]
+            )
+            return token
 
     def is_valid(self, token: str) -> Tuple[bool, Optional[str]]:
         """
@@ -151,134 +434,197 @@ class TokenManager:
         Returns:
             (is_valid, error_message)
         """
-        if token not in self.tokens:
-            return False, "Токен не найден"
-        
-        info = self.tokens[token]
-        
-        if not info.get("active", True):
-            return False, "Токен деактивирован"
-        
-        expires_at = info.get("expires_at")
-        if expires_at:
-            if isinstance(expires_at, str):
-                expires_at = datetime.fromisoformat(expires_at)
-            if datetime.now() > expires_at:
+        with self._lock:
+            info = self.tokens.get(token)
+            if info is None:
+                # Длинные строки не кэшируем, чтобы кэш нельзя было раздуть по памяти
+                if len(token) <= 256:
+                    self._bad_tokens[token] = None
+                    self._bad_tokens.move_to_end(token)
+                    if len(self._bad_tokens) > BAD_TOKENS_MAX:
+                        self._bad_tokens.popitem(last=False)
+                return False, "Токен не найден"
+            
+            if not info.get("active", True):
+                return False, "Токен деактивирован"
+            
+            if info["expires_at_ts"] < time.time():
                 return False, "Токен истёк"
-        
-        # Обновляем статистику использования
-        info["used_count"] = info.get("used_count", 0) + 1
-        info["last_used"] = datetime.now()
-        self._save_tokens()
-        
-        return True, None
+            
+            # Обновляем статистику использования (на диск попадёт при следующем flush)
+            info["used_count"] = info.get("used_count", 0) + 1
+            info["last_used"] = datetime.now()
+            self._mark_used(token)
+            
+            return True, None
 
     def deactivate_token(self, token: str) -> bool:
         """Деактивирует токен."""
-        if token not in self.tokens:
-            return False
-        self.tokens[token]["active"] = False
-        self._save_tokens()
-        return True
+        with self._lock:
+            if token not in self.tokens:
+                return False
+            self.tokens[token]["active"] = False
+            self._changed()
+            self._write("UPDATE tokens SET active = 0 WHERE token = ?", [(token,)])
+            return True
 
     def activate_token(self, token: str) -> bool:
         """Активирует токен."""
-        if token not in self.tokens:
-            return False
-        self.tokens[token]["active"] = True
-        self._save_tokens()
-        return True
+        with self._lock:
+            if token not in self.tokens:
+                return False
+            self.tokens[token]["active"] = True
+            self._changed()
+            self._write("UPDATE tokens SET active = 1 WHERE token = ?", [(token,)])
+            return True
 
     def delete_token(self, token: str) -> bool:
         """Удаляет токен."""
-        if token not in self.tokens:
-            return False
-        del self.tokens[token]
-        self._save_tokens()
-        return True
+        with self._lock:
+            if token not in self.tokens:
+                return False
+            del self.tokens[token]
+            self._unindex_token(token)
+            self._changed()
+            self._write("DELETE FROM tokens WHERE token = ?", [(token,)])
+            return True
+
+    def sync_tokens(self, tokens_data: List[Dict]):
+        """
+        Синхронизирует токены, присланные ботом.
+        
+        Новые токены добавляются целиком, у существующих обновляются
+        только active и description. Записи с некорректными полями пропускаются.
+        Изменения сначала пишутся в базу и только потом применяются в памяти:
+        при ошибке записи исключение пробрасывается, память не меняется.
+        """
+        with self._lock:
+            items = [ti for ti in tokens_data if _sync_entry_valid(ti)]
+            updates = {
+                ti["token"]: (
+                    ti.get("active", self.tokens[ti["token"]]["active"]),
+                    ti.get("description", self.tokens[ti["token"]]["description"]),
+                )
+                for ti in items if ti["token"] in self.tokens
+            }
+            parsed = [(ti["token"], _sync_token_info(ti)) for ti in items if ti["token"] not in self.tokens]
+            new = {token: info for token, info in parsed if info is not None}
+            
+            try:
+                self._execute([
+                    ("UPDATE tokens SET active = ?, description = ? WHERE token = ?",
+                     [(int(active), description, token) for token, (active, description) in updates.items()]),
+                    # Токен может быть "новым" только для этого воркера: строку, созданную другим
+                    # воркером, не перезаписываем, а обновляем как существующий токен
+                    (f"INSERT INTO tokens ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                     "ON CONFLICT(token) DO UPDATE SET active = excluded.active, description = excluded.description",
+                     [_to_row(token, info) for token, info in new.items()]),
+                ])
+            except (sqlite3.Error, OSError) as e:
+                log.warning("Could not save synced tokens to database: %s", e)
+                raise
+            
+            for token, (active, description) in updates.items():
+                self.tokens[token]["active"] = active
+                self.tokens[token]["description"] = description
+            
+            self.tokens.update(new)
+            for token in new:
+                self._index_token(token)
+                self._bad_tokens.pop(token, None)
+            self._changed()
 
     def get_token_info(self, token: str) -> Optional[Dict]:
         """Получает информацию о токене."""
-        if token not in self.tokens:
-            return None
-        info = self.tokens[token].copy()
-        # Конвертируем datetime в строки для удобства
-        if isinstance(info.get("created_at"), datetime):
-            info["created_at"] = info["created_at"].isoformat()
-        if isinstance(info.get("expires_at"), datetime):
-            if info["expires_at"]:
-                info["expires_at"] = info["expires_at"].isoformat()
-        if isinstance(info.get("last_used"), datetime):
-            info["last_used"] = info["last_used"].isoformat()
-        return info
+        with self._lock:
+            if token not in self.tokens:
+                return None
+            info = self.tokens[token].copy()
+            info.pop("expires_at_ts", None)
+            # Конвертируем datetime в строки для удобства
+            if isinstance(info.get("created_at"), datetime):
+                info["created_at"] = info["created_at"].isoformat()
+            if isinstance(info.get("expires_at"), datetime):
+                if info["expires_at"]:
+                    info["expires_at"] = info["expires_at"].isoformat()
+            if isinstance(info.get("last_used"), datetime):
+                info["last_used"] = info["last_used"].isoformat()
+            return info
 
     def list_tokens(self, active_only: bool = False) -> List[Dict]:
-        """Список всех токенов с информацией."""
-        result = []
-        for token, info in self.tokens.items():
-            if active_only and not info.get("active", True):
-                continue
+        """
+        Список всех токенов с информацией.
+        
+        Полный список (active_only=False) кэшируется на LIST_CACHE_TTL секунд,
+        поэтому used_count/last_used в нём могут немного отставать.
+        """
+        with self._lock:
+            now = time.time()
+            if not active_only and self._list_cache is not None and now - self._list_cache_ts < LIST_CACHE_TTL:
+                return self._list_cache
             
-            expires_at = info.get("expires_at")
-            if expires_at:
-                if isinstance(expires_at, str):
-                    expires_at = datetime.fromisoformat(expires_at)
-                if datetime.now() > expires_at:
-                    if active_only:
+            result = []
+            for token, info in self.tokens.items():
+                if active_only:
+                    if not info.get("active", True) or info["expires_at_ts"] < now:
                         continue
+                
+                expires_at = info.get("expires_at")
+                token_info = {
+                    "token": token,
+                    "created_at": info.get("created_at"),
+                    "expires_at": expires_at,
+                    "active": info.get("active", True),
+                    "description": info.get("description", ""),
+                    "used_count": info.get("used_count", 0),
+                    "last_used": info.get("last_used")
+                }
+                
+                # Конвертируем datetime в строки
+                if isinstance(token_info["created_at"], datetime):
+                    token_info["created_at"] = token_info["created_at"].isoformat()
+                if isinstance(token_info["expires_at"], datetime):
+                    if token_info["expires_at"]:
+                        token_info["expires_at"] = token_info["expires_at"].isoformat()
+                if isinstance(token_info["last_used"], datetime):
+                    token_info["last_used"] = token_info["last_used"].isoformat()
+                
+                result.append(token_info)
             
-            token_info = {
-                "token": token,
-                "created_at": info.get("created_at"),
-                "expires_at": expires_at,
-                "active": info.get("active", True),
-                "description": info.get("description", ""),
-                "used_count": info.get("used_count", 0),
-                "last_used": info.get("last_used")
-            }
-            
-            # Конвертируем datetime в строки
-            if isinstance(token_info["created_at"], datetime):
-                token_info["created_at"] = token_info["created_at"].isoformat()
-            if isinstance(token_info["expires_at"], datetime):
-                if token_info["expires_at"]:
-                    token_info["expires_at"] = token_info["expires_at"].isoformat()
-            if isinstance(token_info["last_used"], datetime):
-                token_info["last_used"] = token_info["last_used"].isoformat()
-            
-            result.append(token_info)
-        
-        return result
+            if not active_only:
+                self._list_cache, self._list_cache_ts = result, now
+            return result
 
     def get_time_remaining(self, token: str) -> Optional[str]:
         """Возвращает оставшееся время действия токена в читаемом формате."""
-        if token not in self.tokens:
-            return None
-        
-        info = self.tokens[token]
-        expires_at = info.get("expires_at")
-        
-        if not expires_at:
-            return "Бессрочный"
-        
-        if isinstance(expires_at, str):
-            expires_at = datetime.fromisoformat(expires_at)
-        
-        now = datetime.now()
-        if now > expires_at:
-            return "Истёк"
-        
-        delta = expires_at - now
-        days = delta.days
-        hours, remainder = divmod(delta.seconds, 3600)
-        minutes, _ = divmod(remainder, 60)
-        
-        parts = []
-        if days > 0:
-            parts.append(f"{days} дн.")
-        if hours > 0:
-            parts.append(f"{hours} ч.")
-        if minutes > 0 and days == 0:
-            parts.append(f"{minutes} мин.")
-        
-        return ", ".join(parts) if parts else "Меньше минуты"
+        with self._lock:
+            if token not in self.tokens:
+                return None
+            
+            info = self.tokens[token]
+            expires_at = info.get("expires_at")
+            
+            if not expires_at:
+                return "Бессрочный"
+            
+            if isinstance(expires_at, str):
+                expires_at = _parse_iso(expires_at)
+            
+            now = datetime.now()
+            if now > expires_at:
+                return "Истёк"
+            
+            delta = expires_at - now
+            days = delta.days
+            hours, remainder = divmod(delta.seconds, 3600)
+            minutes, _ = divmod(remainder, 60)
+            
+            parts = []
+            if days > 0:
+                parts.append(f"{days} дн.")
+            if hours > 0:
+                parts.append(f"{hours} ч.")
+            if minutes > 0 and days == 0:
+                parts.append(f"{minutes} мин.")
+            
+            return ", ".join(parts) if parts else "Меньше минуты"
@@ -5,30 +5,37 @@
 
 ВНИМАНИЕ: Это требует API ключ Render.com или ручного обновления через веб-интерфейс.
 """
-import json
 import os
 from pathlib import Path
+
+import orjson
+
 from token_manager import TokenManager
 
+def write_atomic(path: Path, data: bytes):
+    """Пишет файл через временный файл и os.replace, чтобы не оставить его недописанным."""
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+
 def main():
     token_manager = TokenManager()
     tokens = token_manager.list_tokens()
     
-    # Конвертируем в JSON строку
-    data = {}
-    for token_info in tokens:
-        token = token_info.get("token")
-        if token:
-            data[token] = {
-                "created_at": token_info.get("created_at"),
-                "expires_at": token_info.get("expires_at"),
-                "active": token_info.get("active", True),
-                "description": token_info.get("description", ""),
-                "used_count": token_info.get("used_count", 0),
-                "last_used": token_info.get("last_used")
-            }
-    
-    tokens_json = json.dumps(data, indent=2, ensure_ascii=False)
+    # list_tokens() уже отдаёт даты строками - остаётся только убрать ключ token
+    data = {
+        t["token"]: {k: v for k, v in t.items() if k != "token"}
+        for t in tokens if t.get("token")
+    }
+    tokens_json = orjson.dumps(data, option=orjson.OPT_INDENT_2)
     
     print("=" * 60)
     print("Обновите переменную окружения TOKENS_JSON на Render.com:")
@@ -46,8 +53,7 @@ def main():
     
     # Сохраняем в файл для удобства
     output_file = Path(__file__).parent / "tokens_json_output.txt"
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(tokens_json)
+    write_atomic(output_file, tokens_json)
     
     print(f"JSON сохранён в: {output_file}")
     print()